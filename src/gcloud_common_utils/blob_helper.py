@@ -1,6 +1,6 @@
 import logging
 from io import IOBase
-from typing import Set
+from typing import Any, Dict, Optional, Set
 
 from google.cloud import storage
 from nivacloud_logging.log_utils import LogContext
@@ -8,8 +8,13 @@ from typeguard import typechecked
 
 
 @typechecked
-def upload_blob(bucket_name: str, destination_blob_name: str, file_like_object):
-    """Uploads a file to the bucket."""
+def upload_blob(
+    bucket_name: str,
+    destination_blob_name: str,
+    file_like_object,
+    metadata: Optional[Dict[str, Any]] = None,
+):
+    """Uploads a file to the bucket, optionally with metadata."""
     storage_client = storage.Client()
     with LogContext(
         bucket_name=bucket_name, destination_blob_name=destination_blob_name
@@ -17,6 +22,8 @@ def upload_blob(bucket_name: str, destination_blob_name: str, file_like_object):
         logging.info("Attempting to upload file")
         bucket = storage_client.bucket(bucket_name)
         new_blob = bucket.blob(destination_blob_name)
+        if metadata is not None:
+            new_blob.metadata = metadata
         new_blob.upload_from_file(file_like_object)
         logging.info("File uploaded completed")
 
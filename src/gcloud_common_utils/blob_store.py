@@ -0,0 +1,495 @@
+"""
+A single entry point for blob storage, with the backend chosen by URL instead of by import.
+
+    store = BlobStore("gs://my-bucket")            # Google Cloud Storage
+    store = BlobStore("file:///data/my-bucket")    # local filesystem, same layout as blob_helper_local
+    store = BlobStore("mem://my-bucket")           # in-process, for tests and tools
+
+Every backend supports metadata, batching and streaming. Backends are cached per URL and share one
+thread pool, and the Google storage client is only imported and created the first time a gs:// store
+is used, so local-only processes never load google.cloud.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO, IOBase
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from typeguard import typechecked
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+METADATA_SUFFIX = ".metadata.json"
+TEMP_FILE_PREFIX = ".blob_store_upload_"
+
+
+class BlobBackend(Protocol):
+    """Operations a storage backend must implement. Blob names are always full names within the bucket."""
+
+    def upload(
+        self, blob_name: str, file_like_object, metadata: Optional[Dict[str, Any]]
+    ) -> None: ...
+
+    def download(self, blob_name: str, file_like_object) -> Optional[Dict[str, Any]]:
+        """Writes the blob's contents to file_like_object and returns its metadata"""
+        ...
+
+    def stream(self, blob_name: str, chunk_size: int) -> Iterator[bytes]: ...
+
+    def list(self, prefix: str) -> Iterable[str]: ...
+
+    def exists(self, partial_blob_name: str) -> bool: ...
+
+    def delete(self, blob_name: str) -> None: ...
+
+
+class GCSBackend:
+    """Google Cloud Storage backend, all instances share one lazily created storage client"""
+
+    _client = None
+    _client_lock = threading.Lock()
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @classmethod
+    def client(cls):
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    from google.cloud import storage
+
+                    cls._client = storage.Client()
+        return cls._client
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = self.client().bucket(self.bucket_name)
+        return self._bucket
+
+    @contextmanager
+    def _raise_file_not_found(self, blob_name):
+        """Raises google's NotFound as FileNotFoundError, like the other backends"""
+        from google.api_core.exceptions import NotFound
+
+        try:
+            yield
+        except NotFound as e:
+            raise FileNotFoundError(f"gs://{self.bucket_name}/{blob_name}") from e
+
+    def _get_blob(self, blob_name):
+        blob = self.bucket.get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{self.bucket_name}/{blob_name}")
+        return blob
+
+    def upload(self, blob_name, file_like_object, metadata):
+        new_blob = self.bucket.blob(blob_name)
+        if metadata is not None:
+            new_blob.metadata = metadata
+        with self._raise_file_not_found(blob_name):
+            new_blob.upload_from_file(file_like_object, rewind=True)
+
+    def download(self, blob_name, file_like_object):
+        with self._raise_file_not_found(blob_name):
+            blob = self._get_blob(blob_name)
+            blob.download_to_file(file_like_object)
+        return blob.metadata
+
+    def stream(self, blob_name, chunk_size):
+        with self._raise_file_not_found(blob_name):
+            fetched_blob = self._get_blob(blob_name)
+            size = fetched_blob.size or 0
+            # pinning the generation so a concurrent overwrite can't mix two versions into one stream
+            blob = self.bucket.blob(blob_name, generation=fetched_blob.generation)
+            for start in range(0, size, chunk_size):
+                chunk = BytesIO()
+                blob.download_to_file(
+                    chunk, start=start, end=min(start + chunk_size, size) - 1
+                )
+                yield chunk.getvalue()
+
+    def list(self, prefix):
+        return (blob.name for blob in self.bucket.list_blobs(prefix=prefix))
+
+    def exists(self, partial_blob_name):
+        return any(self.bucket.list_blobs(prefix=partial_blob_name, delimiter="/"))
+
+    def delete(self, blob_name):
+        with self._raise_file_not_found(blob_name):
+            self.bucket.blob(blob_name).delete()
+
+
+class FileBackend:
+    """
+    Local filesystem backend rooted at one directory per bucket. Uses the same layout and metadata
+    sidecar files as blob_helper_local, so file://$LOCAL_STORAGE_PATH/<bucket> sees the same blobs.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, blob_name: str) -> str:
+        return os.path.join(self.root, blob_name)
+
+    def upload(self, blob_name, file_like_object, metadata):
+        destination_path = self._path(blob_name)
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        # writing to a hidden temporary file next to the destination and renaming, so readers never see
+        # partial files. list and exists skip these, also when left behind by a killed process
+        tmp_path = os.path.join(
+            os.path.dirname(destination_path), TEMP_FILE_PREFIX + uuid4().hex
+        )
+        try:
+            with open(tmp_path, "xb") as file:
+                file_like_object.seek(0)
+                shutil.copyfileobj(file_like_object, file)
+            os.replace(tmp_path, destination_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        metadata_path = destination_path + METADATA_SUFFIX
+        if metadata is not None:
+            with open(metadata_path, "w") as f:
+                json.dump(metadata, f, indent=2)
+        elif os.path.exists(metadata_path):
+            # an overwrite without metadata clears it, as on the other backends
+            os.remove(metadata_path)
+
+    def _load_metadata(self, blob_name):
+        metadata_path = self._path(blob_name) + METADATA_SUFFIX
+        if not os.path.exists(metadata_path):
+            return None
+        try:
+            with open(metadata_path, "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logging.warning(f"Failed to load metadata from {metadata_path}: {e}")
+            return None
+
+    def download(self, blob_name, file_like_object):
+        with open(self._path(blob_name), "rb") as file:
+            shutil.copyfileobj(file, file_like_object)
+        return self._load_metadata(blob_name)
+
+    def stream(self, blob_name, chunk_size):
+        with open(self._path(blob_name), "rb") as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @staticmethod
+    def _is_blob_file(path: str) -> bool:
+        return not (
+            path.endswith(METADATA_SUFFIX)
+            or os.path.basename(path).startswith(TEMP_FILE_PREFIX)
+        )
+
+    def list(self, prefix):
+        # only walking the directory the prefix is in, like the glob in blob_helper_local.list_blobs
+        for dir_path, _, file_names in os.walk(os.path.dirname(self._path(prefix))):
+            for file_name in file_names:
+                blob_name = os.path.relpath(
+                    os.path.join(dir_path, file_name), self.root
+                ).replace(os.sep, "/")
+                if blob_name.startswith(prefix) and self._is_blob_file(blob_name):
+                    yield blob_name
+
+    def exists(self, partial_blob_name):
+        # like blob_helper_local, the glob doesn't cross "/" which mimics the delimiter used on GCS
+        pattern = glob.escape(self._path(partial_blob_name)) + "*"
+        return any(
+            os.path.isfile(path) and self._is_blob_file(path)
+            for path in glob.glob(pattern)
+        )
+
+    def delete(self, blob_name):
+        os.remove(self._path(blob_name))
+        metadata_path = self._path(blob_name) + METADATA_SUFFIX
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+
+
+class MemoryBackend:
+    """In-process backend keeping blobs in a dict, shared by all stores opened on the same mem:// URL"""
+
+    def __init__(self):
+        self._blobs: Dict[str, Tuple[bytes, Optional[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    def upload(self, blob_name, file_like_object, metadata):
+        file_like_object.seek(0)
+        data = file_like_object.read()
+        with self._lock:
+            self._blobs[blob_name] = (
+                data,
+                dict(metadata) if metadata is not None else None,
+            )
+
+    def _get(self, blob_name):
+        with self._lock:
+            try:
+                return self._blobs[blob_name]
+            except KeyError:
+                raise FileNotFoundError(f"mem://{blob_name}") from None
+
+    def download(self, blob_name, file_like_object):
+        data, metadata = self._get(blob_name)
+        file_like_object.write(data)
+        return dict(metadata) if metadata is not None else None
+
+    def stream(self, blob_name, chunk_size):
+        data, _ = self._get(blob_name)
+        for start in range(0, len(data), chunk_size):
+            yield data[start : start + chunk_size]
+
+    def list(self, prefix):
+        with self._lock:
+            return [name for name in self._blobs if name.startswith(prefix)]
+
+    def exists(self, partial_blob_name):
+        with self._lock:
+            return any(
+                name.startswith(partial_blob_name)
+                and "/" not in name[len(partial_blob_name) :]
+                for name in self._blobs
+            )
+
+    def delete(self, blob_name):
+        with self._lock:
+            try:
+                del self._blobs[blob_name]
+            except KeyError:
+                raise FileNotFoundError(f"mem://{blob_name}") from None
+
+
+def _gcs_backend(parsed_url) -> BlobBackend:
+    return GCSBackend(parsed_url.netloc)
+
+
+def _file_backend(parsed_url) -> BlobBackend:
+    return FileBackend(parsed_url.netloc + parsed_url.path)
+
+
+def _memory_backend(parsed_url) -> BlobBackend:
+    return MemoryBackend()
+
+
+_backend_factories: Dict[str, Callable[[Any], BlobBackend]] = {
+    "gs": _gcs_backend,
+    "file": _file_backend,
+    "mem": _memory_backend,
+}
+_backends: Dict[str, BlobBackend] = {}
+_backends_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def register_backend(scheme: str, factory: Callable[[Any], BlobBackend]):
+    """Registers a backend factory for a URL scheme. The factory receives the urlsplit() result of the URL"""
+    _backend_factories[scheme] = factory
+
+
+def get_backend(url: str) -> BlobBackend:
+    """Returns the backend for url, creating it on first use and reusing it for later stores on the same URL"""
+    url = url.rstrip("/")
+    with _backends_lock:
+        if url not in _backends:
+            parsed_url = urlsplit(url)
+            if parsed_url.scheme not in _backend_factories:
+                raise ValueError(
+                    f"Unsupported blob store url {url}, expected one of "
+                    f"{', '.join(f'{scheme}://' for scheme in _backend_factories)}"
+                )
+            _backends[url] = _backend_factories[parsed_url.scheme](parsed_url)
+        return _backends[url]
+
+
+def clear_backends():
+    """Forgets all cached backends, so the next store on a URL gets a new one. Mostly useful in tests"""
+    with _backends_lock:
+        _backends.clear()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix="blob_store")
+        return _executor
+
+
+class BlobStore:
+    """
+    Blob storage for one bucket, with the backend chosen by the URL scheme (gs://, file://, mem://).
+
+    Example usage:
+
+    store = BlobStore(os.environ.get("BLOB_STORE_URL", "gs://my-bucket"))
+    with open("data.csv", "rb") as f:
+        store.upload_blob("incoming/data.csv", f, metadata={"source": "sensor-1"})
+    for chunk in store.stream_blob("incoming/data.csv"):
+        ...
+    """
+
+    def __init__(self, url: str, backend: Optional[BlobBackend] = None):
+        """backend overrides the cached backend for url, e.g. to use a preconfigured GCSBackend"""
+        self.url = url.rstrip("/")
+        self.backend = backend if backend is not None else get_backend(self.url)
+
+    def __repr__(self):
+        return f"BlobStore({self.url!r})"
+
+    @typechecked
+    def upload_blob(
+        self,
+        destination_blob_name: str,
+        file_like_object,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        """Uploads a file-like object, optionally with metadata, to the blob destination_blob_name"""
+        logging.info(
+            "Uploading blob", extra={"url": self.url, "file": destination_blob_name}
+        )
+        self.backend.upload(destination_blob_name, file_like_object, metadata)
+        logging.info("Blob uploaded", extra={"file": destination_blob_name})
+
+    @typechecked
+    def download_blob(
+        self,
+        source_blob_name: str,
+        file_like_object: IOBase,
+        include_metadata: bool = False,
+    ) -> Union[IOBase, Tuple[IOBase, Optional[Dict[str, Any]]]]:
+        """
+        Downloads a blob into a file-like object.
+
+        Returns the file-like object, or a tuple (file_like_object, metadata) if include_metadata is True,
+        where metadata may be None if the blob has no metadata.
+        """
+        logging.info(
+            "Downloading blob", extra={"url": self.url, "file": source_blob_name}
+        )
+        metadata = self.backend.download(source_blob_name, file_like_object)
+        logging.info("Blob downloaded", extra={"file": source_blob_name})
+        if include_metadata:
+            return file_like_object, metadata
+        return file_like_object
+
+    @typechecked
+    def stream_blob(
+        self, source_blob_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """Yields the blob's contents in chunks of at most chunk_size bytes, without holding it all in memory"""
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+        logging.info(
+            "Streaming blob", extra={"url": self.url, "file": source_blob_name}
+        )
+        return self.backend.stream(source_blob_name, chunk_size)
+
+    @typechecked
+    def list_blobs(self, prefix: str) -> Set[str]:
+        """Lists the blobs starting with prefix. Like blob_helper.list_blobs this returns file names without the path"""
+        blob_file_set = {
+            name.rsplit("/", 1)[1] if "/" in name else name
+            for name in self.backend.list(prefix)
+        }
+        logging.info(
+            f'{len(blob_file_set)} files found in {self.url} with prefix "{prefix}"',
+            extra={"bucket_file_count": len(blob_file_set), "prefix": prefix},
+        )
+        return blob_file_set
+
+    @typechecked
+    def blob_exists(self, partial_file_path: str) -> bool:
+        """partial_file_path will also correctly match if a full file path is supplied"""
+        logging.info(
+            "Checking if file exists",
+            extra={"url": self.url, "file_path": partial_file_path},
+        )
+        return self.backend.exists(partial_file_path)
+
+    @typechecked
+    def delete_blob(self, blob_name: str):
+        logging.info("Deleting blob", extra={"url": self.url, "file": blob_name})
+        self.backend.delete(blob_name)
+        logging.info("Blob deleted", extra={"file": blob_name})
+
+    @typechecked
+    def upload_blobs(
+        self,
+        file_like_objects: Mapping[str, Any],
+        metadata: Optional[Mapping[str, Dict[str, Any]]] = None,
+    ):
+        """
+        Uploads several blobs concurrently on the shared thread pool.
+
+        Args:
+            file_like_objects: blob name to the file-like object to upload there.
+            metadata (optional): blob name to metadata, blobs missing from it are uploaded without metadata.
+        """
+        metadata = metadata or {}
+        futures = [
+            _get_executor().submit(
+                self.upload_blob, name, file_like_object, metadata.get(name)
+            )
+            for name, file_like_object in file_like_objects.items()
+        ]
+        for future in futures:
+            future.result()
+
+    @typechecked
+    def download_blobs(
+        self, source_blob_names: Iterable[str], include_metadata: bool = False
+    ) -> Dict[str, Union[IOBase, Tuple[IOBase, Optional[Dict[str, Any]]]]]:
+        """
+        Downloads several blobs concurrently on the shared thread pool into new BytesIO buffers.
+
+        Returns a dict of blob name to what download_blob returns for it, with buffers rewound to the start.
+        """
+
+        def download(name):
+            buffer = BytesIO()
+            result = self.download_blob(name, buffer, include_metadata)
+            buffer.seek(0)
+            return result
+
+        futures = {
+            name: _get_executor().submit(download, name) for name in source_blob_names
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    @typechecked
+    def delete_blobs(self, blob_names: Iterable[str]):
+        """Deletes several blobs concurrently on the shared thread pool"""
+        futures = [
+            _get_executor().submit(self.delete_blob, name) for name in blob_names
+        ]
+        for future in futures:
+            future.result()
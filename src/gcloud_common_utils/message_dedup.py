@@ -0,0 +1,170 @@
+"""
+Bounded, TTL-evicted stores of processed message keys, used by pubsub_helpers.subscribe_synchronously
+to ack redelivered messages without handling them again.
+
+Keys are only recorded once the handler acks a message, so a message whose handling failed is still
+retried when pubsub redelivers it.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Protocol
+
+
+class DedupStore(Protocol):
+    def seen(self, key: str) -> bool:
+        """Returns whether key was marked as seen and hasn't expired yet"""
+        ...
+
+    def mark_seen(self, key: str) -> None: ...
+
+
+def message_id_key(message) -> str:
+    """Deduplicates on the pubsub message id, which is the same for every redelivery of a message"""
+    return message.message_id
+
+
+def storage_object_key(message) -> Optional[str]:
+    """
+    Deduplicates cloud storage notifications on event type, bucket, object and generation, so a notification
+    for the same event on the same version of a blob is only handled once even if it was published as separate
+    messages, while e.g. OBJECT_FINALIZE and OBJECT_DELETE for that version are both handled.
+
+    Metadata changes keep the generation, so OBJECT_METADATA_UPDATE is also keyed on the metageneration from
+    the JSON payload. Messages without these attributes, or metadata updates without a JSON payload, are not
+    deduplicated.
+    """
+    attributes = message.attributes
+    try:
+        key = (
+            f"{attributes['eventType']}:{attributes['bucketId']}/"
+            f"{attributes['objectId']}#{attributes['objectGeneration']}"
+        )
+    except KeyError:
+        return None
+    if attributes["eventType"] == "OBJECT_METADATA_UPDATE":
+        try:
+            key += f".{json.loads(message.data)['metageneration']}"
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+    return key
+
+
+class MemoryDedupStore:
+    """In-process LRU store, holding at most max_size keys for at most ttl_seconds each"""
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl_seconds: float = 3600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._keys: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key: str) -> bool:
+        with self._lock:
+            seen_at = self._keys.get(key)
+            if seen_at is None:
+                return False
+            if self._clock() - seen_at > self.ttl_seconds:
+                del self._keys[key]
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def mark_seen(self, key: str) -> None:
+        with self._lock:
+            now = self._clock()
+            self._keys[key] = now
+            self._keys.move_to_end(key)
+            # least recently used keys are at the front, evicting from there until within size and ttl
+            while self._keys:
+                oldest_key, oldest_seen_at = next(iter(self._keys.items()))
+                if (
+                    len(self._keys) <= self.max_size
+                    and now - oldest_seen_at <= self.ttl_seconds
+                ):
+                    break
+                del self._keys[oldest_key]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class SqliteDedupStore:
+    """
+    Store kept in a SQLite file, so several worker processes on the same host can share it.
+    Holds at most max_size keys for at most ttl_seconds each.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 100_000,
+        ttl_seconds: float = 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS dedup_keys_seen_at ON dedup_keys (seen_at)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # a short-lived connection per call keeps the store safe to use from several threads and processes
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:  # commits, or rolls back on exceptions
+                yield connection
+        finally:
+            connection.close()
+
+    def seen(self, key: str) -> bool:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT 1 FROM dedup_keys WHERE key = ? AND seen_at >= ?",
+                (key, self._clock() - self.ttl_seconds),
+            ).fetchone()
+        return row is not None
+
+    def mark_seen(self, key: str) -> None:
+        now = self._clock()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO dedup_keys (key, seen_at) VALUES (?, ?)",
+                (key, now),
+            )
+            connection.execute(
+                "DELETE FROM dedup_keys WHERE seen_at < ?", (now - self.ttl_seconds,)
+            )
+            # trimming from the key just past the newest max_size ones, found through the seen_at index.
+            # rowid breaks ties in seen_at, and the key just inserted is always kept
+            connection.execute(
+                "DELETE FROM dedup_keys WHERE key != ? AND (seen_at, rowid) <= "
+                "(SELECT seen_at, rowid FROM dedup_keys "
+                "ORDER BY seen_at DESC, rowid DESC LIMIT 1 OFFSET ?)",
+                (key, self.max_size),
+            )
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM dedup_keys").fetchone()[0]
@@ -1,12 +1,14 @@
 import logging
 import signal
-from typing import Callable
+from typing import Callable, Optional
 from uuid import uuid4
 
 from google.api_core.exceptions import DeadlineExceeded
 from google.cloud.pubsub_v1 import SubscriberClient
 from nivacloud_logging.log_utils import LogContext, generate_trace_id
 
+from gcloud_common_utils.message_dedup import DedupStore, message_id_key
+
 
 class SigHandler:
     def __init__(self):
@@ -33,8 +35,37 @@ def _create_message_ack_fn(
     return ack_message
 
 
-def _pull_and_handle_message(subscriber, subscription_path, message_handler):
-    """Pulls one message and calls the message handler, Return whether this subscription is currently doing work"""
+def _create_dedup_ack_fn(
+    ack_callback: Callable, dedup_store: DedupStore, dedup_key: str
+) -> Callable:
+    def ack_message():
+        ack_callback()
+        try:
+            dedup_store.mark_seen(dedup_key)
+        except Exception:
+            # deduplication is only an optimisation, the message is acked regardless
+            logging.exception(
+                "Failed to record message in dedup store",
+                extra={"dedup_key": dedup_key},
+            )
+
+    return ack_message
+
+
+def _pull_and_handle_message(
+    subscriber,
+    subscription_path,
+    message_handler,
+    dedup_store: Optional[DedupStore] = None,
+    dedup_key_fn: Callable = message_id_key,
+):
+    """
+    Pulls one message and calls the message handler, Return whether this subscription is currently doing work
+
+    If a dedup_store is given, messages whose dedup_key_fn(message) was already acked are acked again without
+    calling the message handler. A dedup_key_fn returning None disables deduplication for that message, and so
+    do errors from dedup_key_fn or the dedup store, which are logged.
+    """
     response = subscriber.pull(
         subscription=subscription_path, max_messages=1, timeout=2
     )
@@ -52,11 +83,39 @@ def _pull_and_handle_message(subscriber, subscription_path, message_handler):
         received_message.message.attributes.get("trace_id") or generate_trace_id()
     )
     with LogContext(trace_id=trace_id, span_id=str(uuid4())):
+        dedup_key = None
+        is_duplicate = False
+        if dedup_store is not None:
+            try:
+                dedup_key = dedup_key_fn(received_message.message)
+                is_duplicate = dedup_key is not None and dedup_store.seen(dedup_key)
+            except Exception:
+                logging.exception(
+                    "Failed to check message in dedup store, handling it as new",
+                    extra={"dedup_key": dedup_key},
+                )
+                dedup_key = None
+        if dedup_key is not None:
+            if is_duplicate:
+                logging.info(
+                    "Message was already handled, acking duplicate",
+                    extra={
+                        "dedup_key": dedup_key,
+                        "message_id": received_message.message.message_id,
+                    },
+                )
+                ack_callback()
+                return
+            ack_callback = _create_dedup_ack_fn(ack_callback, dedup_store, dedup_key)
         message_handler(received_message.message, ack_callback)
 
 
 def subscribe_synchronously(
-    project_id: str, subscription_name: str, callback: Callable
+    project_id: str,
+    subscription_name: str,
+    callback: Callable,
+    dedup_store: Optional[DedupStore] = None,
+    dedup_key_fn: Callable = message_id_key,
 ):
     """
     Creates a pubsub synchronous subscription function for a given project_id and subscription name.
@@ -71,6 +130,17 @@ def subscribe_synchronously(
 
     subscription_name = f"signals2tsb-{environment}-{signal_list_topic}"
     subscribe_synchronously(project_id=project_id, subscription_name=subscription_name, callback=message_handler)
+
+    Pubsub delivers messages at least once. To ack redeliveries without calling the handler again, pass a
+    dedup_store from gcloud_common_utils.message_dedup, optionally with a dedup_key_fn (default message_id_key):
+
+    subscribe_synchronously(
+        project_id=project_id,
+        subscription_name=subscription_name,
+        callback=message_handler,
+        dedup_store=SqliteDedupStore("/var/run/my-service/dedup.sqlite"),
+        dedup_key_fn=storage_object_key,
+    )
     """
     sig_handler = SigHandler()
     subscriber = SubscriberClient()
@@ -81,7 +151,13 @@ def subscribe_synchronously(
     def subscribe(message_handler: Callable):
         while sig_handler.running:
             try:
-                _pull_and_handle_message(subscriber, subscription_path, message_handler)
+                _pull_and_handle_message(
+                    subscriber,
+                    subscription_path,
+                    message_handler,
+                    dedup_store,
+                    dedup_key_fn,
+                )
             except DeadlineExceeded:
                 logging.debug(
                     "Received deadline exceeded event when polling, this is expected if no messages"
@@ -0,0 +1,213 @@
+import os
+import subprocess
+import sys
+from io import BytesIO
+from unittest import mock
+
+import pytest
+
+from gcloud_common_utils import blob_helper_local
+from gcloud_common_utils.blob_store import (
+    TEMP_FILE_PREFIX,
+    BlobStore,
+    GCSBackend,
+    MemoryBackend,
+    clear_backends,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cached_backends():
+    yield
+    clear_backends()
+
+
+@pytest.fixture(params=["file", "mem"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return BlobStore(f"file://{tmp_path}/a_test_bucket")
+    return BlobStore("mem://a_test_bucket")
+
+
+def test_upload_and_download_with_metadata(store):
+    byte_string = b"yada yada yada\nmore yadas!!\n"
+    test_metadata = {"x-goog-meta-up-app-user": "test@niva.no"}
+
+    with BytesIO(byte_string) as upload_buffer:
+        store.upload_blob(
+            "folder/a_test_file.txt", upload_buffer, metadata=test_metadata
+        )
+
+    with BytesIO() as download_buffer:
+        file_obj, metadata = store.download_blob(
+            "folder/a_test_file.txt", download_buffer, include_metadata=True
+        )
+        assert download_buffer.getvalue() == byte_string
+        assert metadata == test_metadata
+
+    assert store.list_blobs("folder/") == {"a_test_file.txt"}
+    assert store.blob_exists("folder/a_test")
+    assert not store.blob_exists("a_test")
+
+    store.delete_blob("folder/a_test_file.txt")
+    assert store.list_blobs("") == set()
+
+
+def test_stream_blob(store):
+    byte_string = bytes(range(256)) * 10
+    store.upload_blob("streamed.bin", BytesIO(byte_string))
+
+    chunks = list(store.stream_blob("streamed.bin", chunk_size=1000))
+
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 560]
+    assert b"".join(chunks) == byte_string
+
+
+def test_batch_operations(store):
+    blobs = {f"batch/file_{i}.txt": BytesIO(f"content {i}".encode()) for i in range(5)}
+
+    store.upload_blobs(blobs, metadata={"batch/file_0.txt": {"first": "yes"}})
+    downloaded = store.download_blobs(blobs, include_metadata=True)
+
+    assert {name: (buf.read(), meta) for name, (buf, meta) in downloaded.items()} == {
+        f"batch/file_{i}.txt": (
+            f"content {i}".encode(),
+            {"first": "yes"} if i == 0 else None,
+        )
+        for i in range(5)
+    }
+
+    store.delete_blobs(blobs)
+    assert not store.blob_exists("batch/")
+
+
+def test_stream_blob_invalid_chunk_size(store):
+    store.upload_blob("streamed.bin", BytesIO(b"content"))
+
+    with pytest.raises(ValueError):
+        store.stream_blob("streamed.bin", chunk_size=0)
+
+
+def test_list_blobs_in_missing_directory(store):
+    store.upload_blob("incoming/2024/a_file.txt", BytesIO(b"content"))
+
+    assert store.list_blobs("incoming/2024/") == {"a_file.txt"}
+    assert store.list_blobs("incoming/20") == {"a_file.txt"}
+    assert store.list_blobs("incoming/2025/") == set()
+    assert store.list_blobs("missing/") == set()
+
+
+def test_overwrite_without_metadata_clears_metadata(store):
+    store.upload_blob("a_file.txt", BytesIO(b"first"), metadata={"k": "v"})
+    store.upload_blob("a_file.txt", BytesIO(b"second"))
+
+    _, metadata = store.download_blob("a_file.txt", BytesIO(), include_metadata=True)
+
+    assert metadata is None
+
+
+def test_file_store_temporary_files(tmp_path):
+    store = BlobStore(f"file://{tmp_path}/a_test_bucket")
+    store.upload_blob("folder/a_file.txt", BytesIO(b"content"))
+    # a temporary file left behind by an upload that was killed halfway
+    (tmp_path / "a_test_bucket" / "folder" / f"{TEMP_FILE_PREFIX}abc").write_bytes(b"")
+
+    assert store.list_blobs("") == {"a_file.txt"}
+    assert not store.blob_exists(f"folder/{TEMP_FILE_PREFIX}")
+
+    umask = os.umask(0)
+    os.umask(umask)
+    mode = os.stat(tmp_path / "a_test_bucket" / "folder" / "a_file.txt").st_mode
+    assert mode & 0o777 == 0o666 & ~umask
+
+
+@pytest.fixture
+def gcs_store():
+    data = bytes(range(256)) * 10
+
+    def download_to_file(file_obj, start=None, end=None):
+        file_obj.write(data[start : end + 1])
+
+    fetched_blob = mock.Mock(size=len(data), generation=7, metadata=None)
+    # blobs created by bucket.blob() have no properties loaded
+    unloaded_blob = mock.Mock(size=None, download_to_file=download_to_file)
+    bucket = mock.Mock()
+    bucket.get_blob.return_value = fetched_blob
+    bucket.blob.return_value = unloaded_blob
+
+    backend = GCSBackend("a_mocked_bucket")
+    backend._bucket = bucket
+    return BlobStore("gs://a_mocked_bucket", backend=backend), data
+
+
+def test_gcs_stream_blob(gcs_store):
+    store, data = gcs_store
+
+    chunks = list(store.stream_blob("streamed.bin", chunk_size=1000))
+
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 560]
+    assert b"".join(chunks) == data
+    store.backend.bucket.blob.assert_called_once_with("streamed.bin", generation=7)
+
+
+def test_gcs_missing_blob_raises_file_not_found(gcs_store):
+    exceptions = pytest.importorskip("google.api_core.exceptions")
+    store, _ = gcs_store
+    store.backend.bucket.blob.return_value.delete.side_effect = exceptions.NotFound(
+        "missing"
+    )
+    store.backend.bucket.get_blob.return_value.download_to_file = mock.Mock(
+        side_effect=exceptions.NotFound("missing")
+    )
+
+    with pytest.raises(FileNotFoundError):
+        store.delete_blob("missing.txt")
+    with pytest.raises(FileNotFoundError):
+        store.download_blob("missing.txt", BytesIO())
+
+
+def test_stores_on_same_url_share_backend():
+    backend = BlobStore("mem://shared").backend
+    assert backend is BlobStore("mem://shared/").backend
+    assert isinstance(backend, MemoryBackend)
+    assert backend is not BlobStore("mem://other").backend
+
+    clear_backends()
+    assert backend is not BlobStore("mem://shared").backend
+
+
+def test_unsupported_scheme():
+    with pytest.raises(ValueError):
+        BlobStore("s3://a_bucket")
+
+
+def test_file_store_reads_blob_helper_local_layout(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOCAL_STORAGE_PATH", str(tmp_path))
+    blob_helper_local.upload_blob(
+        "test_bucket", "some/file.txt", BytesIO(b"content"), metadata={"a": "b"}
+    )
+
+    store = BlobStore(f"file://{tmp_path}/test_bucket")
+    _, metadata = store.download_blob("some/file.txt", BytesIO(), include_metadata=True)
+
+    assert metadata == {"a": "b"}
+    assert store.list_blobs("some/") == {"file.txt"}
+
+
+def test_importing_blob_store_does_not_load_google_cloud():
+    src_dir = os.path.dirname(
+        os.path.dirname(sys.modules["gcloud_common_utils"].__file__)
+    )
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from gcloud_common_utils.blob_store import BlobStore; "
+            "BlobStore('mem://x'); print('google.cloud' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": src_dir},
+    )
+    assert result.stdout.strip() == "False"
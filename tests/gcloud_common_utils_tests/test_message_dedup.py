@@ -0,0 +1,207 @@
+import sqlite3
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from gcloud_common_utils.message_dedup import (
+    MemoryDedupStore,
+    SqliteDedupStore,
+    storage_object_key,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryDedupStore(**kwargs)
+        return SqliteDedupStore(str(tmp_path / "dedup.sqlite"), **kwargs)
+
+    return make
+
+
+def test_dedup_store_ttl(make_store):
+    clock = FakeClock()
+    store = make_store(ttl_seconds=60, clock=clock)
+
+    assert not store.seen("a")
+    store.mark_seen("a")
+    assert store.seen("a")
+
+    clock.now += 61
+    assert not store.seen("a")
+
+
+@pytest.mark.parametrize("tick", [1, 0])
+def test_dedup_store_is_bounded(make_store, tick):
+    clock = FakeClock()
+    store = make_store(max_size=3, clock=clock)
+
+    for key in "abcd":
+        clock.now += tick
+        store.mark_seen(key)
+
+    assert len(store) == 3
+    assert not store.seen("a")
+    assert all(store.seen(key) for key in "bcd")
+
+
+def test_sqlite_dedup_store_is_shared(tmp_path):
+    path = str(tmp_path / "dedup.sqlite")
+    SqliteDedupStore(path).mark_seen("a")
+
+    assert SqliteDedupStore(path).seen("a")
+
+
+def test_storage_object_key():
+    message = SimpleNamespace(
+        attributes={
+            "eventType": "OBJECT_FINALIZE",
+            "bucketId": "a_bucket",
+            "objectId": "some/file.csv",
+            "objectGeneration": "1634567890",
+        }
+    )
+
+    assert (
+        storage_object_key(message)
+        == "OBJECT_FINALIZE:a_bucket/some/file.csv#1634567890"
+    )
+    assert storage_object_key(SimpleNamespace(attributes={})) is None
+
+    message.attributes["eventType"] = "OBJECT_METADATA_UPDATE"
+    message.data = b'{"metageneration": "2"}'
+    assert (
+        storage_object_key(message)
+        == "OBJECT_METADATA_UPDATE:a_bucket/some/file.csv#1634567890.2"
+    )
+    message.data = b""
+    assert storage_object_key(message) is None
+
+
+class FakeSubscriber:
+    """Pulls the given messages in order, each a (message_id, attributes) or (message_id, attributes, data) tuple"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.acked_ids = []
+
+    def pull(self, **kwargs):
+        message_id, attributes, *data = self.messages.pop(0)
+        return SimpleNamespace(
+            received_messages=[
+                SimpleNamespace(
+                    ack_id=f"ack-{message_id}",
+                    message=SimpleNamespace(
+                        message_id=message_id,
+                        attributes=attributes,
+                        data=data[0] if data else b"",
+                    ),
+                )
+            ]
+        )
+
+    def acknowledge(self, request):
+        self.acked_ids.extend(request["ack_ids"])
+
+
+@pytest.fixture
+def pull_and_handle():
+    pytest.importorskip("google.cloud.pubsub_v1")
+    pytest.importorskip("nivacloud_logging")
+    from gcloud_common_utils.pubsub_helpers import _pull_and_handle_message
+
+    handled = []
+
+    def pull_and_handle(subscriber, store, ack=True, **kwargs):
+        def message_handler(message, ack_callback):
+            handled.append(message.message_id)
+            if ack:
+                ack_callback()
+
+        _pull_and_handle_message(subscriber, "path", message_handler, store, **kwargs)
+
+    pull_and_handle.handled = handled
+    return pull_and_handle
+
+
+def test_pull_and_handle_message_acks_duplicates_without_handling(pull_and_handle):
+    subscriber = FakeSubscriber([("1", {})] * 3)
+    store = MemoryDedupStore()
+
+    for _ in range(3):
+        pull_and_handle(subscriber, store)
+
+    assert pull_and_handle.handled == ["1"]
+    assert subscriber.acked_ids == ["ack-1", "ack-1", "ack-1"]
+
+
+def test_pull_and_handle_message_handles_unacked_redelivery(pull_and_handle):
+    subscriber = FakeSubscriber([("1", {})] * 2)
+    store = MemoryDedupStore()
+
+    pull_and_handle(subscriber, store, ack=False)
+    pull_and_handle(subscriber, store)
+
+    assert pull_and_handle.handled == ["1", "1"]
+    assert subscriber.acked_ids == ["ack-1"]
+    assert store.seen("1")
+
+
+def test_pull_and_handle_message_without_dedup_key(pull_and_handle):
+    subscriber = FakeSubscriber([("1", {})] * 2)
+    store = MemoryDedupStore()
+
+    for _ in range(2):
+        pull_and_handle(subscriber, store, dedup_key_fn=storage_object_key)
+
+    assert pull_and_handle.handled == ["1", "1"]
+    assert len(store) == 0
+
+
+def test_pull_and_handle_message_storage_event_types(pull_and_handle):
+    attributes = {
+        "bucketId": "a_bucket",
+        "objectId": "some/file.csv",
+        "objectGeneration": "1634567890",
+    }
+    metadata_update = {**attributes, "eventType": "OBJECT_METADATA_UPDATE"}
+    subscriber = FakeSubscriber(
+        [
+            ("1", {**attributes, "eventType": "OBJECT_FINALIZE"}),
+            ("2", {**attributes, "eventType": "OBJECT_FINALIZE"}),
+            ("3", {**attributes, "eventType": "OBJECT_DELETE"}),
+            ("4", metadata_update, b'{"metageneration": "2"}'),
+            ("5", metadata_update, b'{"metageneration": "3"}'),
+            ("6", metadata_update, b'{"metageneration": "3"}'),
+        ]
+    )
+    store = MemoryDedupStore()
+
+    for _ in range(6):
+        pull_and_handle(subscriber, store, dedup_key_fn=storage_object_key)
+
+    assert pull_and_handle.handled == ["1", "3", "4", "5"]
+    assert subscriber.acked_ids == [f"ack-{i}" for i in range(1, 7)]
+
+
+def test_pull_and_handle_message_dedup_store_errors(pull_and_handle):
+    subscriber = FakeSubscriber([("1", {})] * 2)
+    store = mock.Mock()
+    store.seen.side_effect = sqlite3.OperationalError("database is locked")
+    store.mark_seen.side_effect = sqlite3.OperationalError("database is locked")
+
+    for _ in range(2):
+        pull_and_handle(subscriber, store)
+
+    assert pull_and_handle.handled == ["1", "1"]
+    assert subscriber.acked_ids == ["ack-1", "ack-1"]